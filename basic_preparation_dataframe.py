@@ -15,6 +15,80 @@ import numpy as np
 import matplotlib.pyplot as plt
 from bld.project_paths import project_paths_join as ppj
 
+# Sequential game indicators and group compositions:
+# by session in LBE
+LBE_SEQ = {
+    '170708_1018': 1,
+    '170710_0841': 0,
+    '170710_1034': 1,
+    '170710_1251': 0
+}
+LBE_GROUP = {
+    "170708_1018": 'HHL',
+    "170710_0841": 'HHL',
+    "170710_1034": 'LHL',
+    "170710_1251": 'LHL'
+}
+# by treatment number and leader's type in ELBE
+ELBE_SEQ = {
+    2: 1,
+    1: 0
+}
+ELBE_GROUP = {
+    2: 'HHL',
+    1: 'LHL'
+}
+# players' types by role order in ELBE
+ELBE_TYPE = {
+    3: 1,
+    2: 2
+}
+
+# Ticks on both axes of the contributions patterns
+TICKS = np.arange(0, 21, 2)
+
+# Lines (y(x), style, label) plotted with the contributions patterns
+PATTERNS = {
+    "Lf": [
+        (lambda x: x, '--k', r"$45^\circ$ (L matches L-leader)"),
+        (lambda x: 2*x/5, ':k', "Equal payoffs wrt H-leader"),
+        (lambda x: 2*x/3, '-.k', "Proportional to return wrt H-leader"),
+    ],
+    "Hf": [
+        (lambda x: np.minimum(x*2, 20), ':k', "Equal payoffs wrt L-leader"),
+        (lambda x: x, '--k', r"$45^\circ$ (H matches H-leader)"),
+        (
+            lambda x: np.minimum(x*1.5, 20),
+            '-.k',
+            "Proportional to return wrt L-leader"
+        ),
+    ],
+    "Hl": [
+        (lambda x: x, '--k', r"$45^\circ$ (H matches H-leader)"),
+        (lambda x: 2*x/5, ':k', "Equal payoffs, L-follower"),
+        (lambda x: 2*x/3, '-.k', "Proportional to return, L-follower"),
+    ],
+    "Ll": [
+        (lambda x: np.minimum(x*2, 20), ':k', "Equal payoffs, H-follower"),
+        (lambda x: x, '--k', r"$45^\circ$ (L matches L-leader)"),
+        (
+            lambda x: np.minimum(x*1.5, 20),
+            '-.k',
+            "Proportional to return, H-follower"
+        ),
+    ],
+}
+
+# Functions available in :func:`summarize`
+STATISTICS = {
+    "mean": "mean",
+    "std": "std",
+    "min": "min",
+    "max": "max",
+    "count": "count",
+    "median": "median",
+}
+
 
 def pilot_sessions(project):
     """Returns data frame *rd* read from the CSV file with generated:
@@ -35,45 +109,34 @@ def pilot_sessions(project):
 
     abs_file_path = ppj('IN_DATA', datafile)
 
-    rd = pandas.read_csv(abs_file_path, sep='\t')
+    # dtypes of the columns used below (the rest is inferred)
+    rd = pandas.read_csv(abs_file_path, sep='\t', dtype={
+        'SessionID': 'category',
+        'Subject': 'Int32',
+        'TreatmentNumber': 'Int8',
+        'leader_type': 'Int8',
+        'roleorder': 'Int8'
+    })
 
     if project == "LBE":
-        rd['sequential_game'] = rd['SessionID'].map({
-            '170708_1018': 1,
-            '170710_0841': 0,
-            '170710_1034': 1,
-            '170710_1251': 0
-        })
-        rd['Group_Composition'] = rd['SessionID'].map({
-            "170708_1018": 'HHL',
-            "170710_0841": 'HHL',
-            "170710_1034": 'LHL',
-            "170710_1251": 'LHL'
-        })
+        # mapping a categorical may return a categorical: keep plain arrays
+        rd['sequential_game'] = np.asarray(rd['SessionID'].map(LBE_SEQ))
+        rd['Group_Composition'] = np.asarray(
+            rd['SessionID'].map(LBE_GROUP)
+        )
     elif project == "ELBE":
-        rd['sequential_game'] = rd['TreatmentNumber'].map({
-            2: 1,
-            1: 0
-        })
-        rd['Group_Composition'] = rd['leader_type'].map({
-            2: 'HHL',
-            1: 'LHL'
-        })
+        rd['sequential_game'] = rd['TreatmentNumber'].map(ELBE_SEQ)
+        rd['Group_Composition'] = rd['leader_type'].map(ELBE_GROUP)
         # THIS IS AN ARTIFACT FROM RAFAEL'S ZTREE FILES: 'type' was overwritten!
-        rd['player_type'] = rd['roleorder'].map({
-            3: 1,
-            2: 2
-        }).fillna(rd['leader_type'])
+        rd['player_type'] = rd['roleorder'].map(ELBE_TYPE) \
+            .fillna(rd['leader_type'])
     else:
         raise ValueError("Incorrect project name, required: 'LBE' or 'ELBE'")
 
-    rd['subject_id'] = 0
-    for s, session in enumerate(rd['SessionID'].unique()):
-        for subject in rd.loc[(rd['SessionID'] == session)]['Subject'].unique():
-            rd.loc[
-                (rd['SessionID'] == session) & (rd['Subject'] == subject),
-                'subject_id'
-            ] = s*100 + subject
+    rd['Group_Composition'] = rd['Group_Composition'].astype('category')
+
+    # unique subject IDs: sessions are numbered in order of appearance
+    rd['subject_id'] = pandas.factorize(rd['SessionID'])[0]*100 + rd['Subject']
 
     # Compute only payoffs from PG (not from correct guessing of beliefs!)
     # Corresponds to ProfitPG in one-shot game and Profit in repeated game
@@ -114,7 +177,9 @@ def plot_pattern(
         "Need to provide the name of the file for the figure to be saved to"
     x = np.arange(len(s1))
 
-    graph = plt.figure()
+    # pre-sized figure with fixed margins: no tight bbox reflow on saving
+    graph = plt.figure(figsize=(6, 6))
+    graph.subplots_adjust(left=0.12, right=0.96, bottom=0.1, top=0.92)
     plt.subplot(111)
     plt.plot(x, s1, 'ko-', label=s1_label)
     plt.plot(x, s2, 'k^-', fillstyle='none', label=s2_label)
@@ -127,54 +192,21 @@ def plot_pattern(
         plt.ylabel('Contributions / Beliefs')
     plt.axis('scaled')
     plt.xlim(-1, 21)
-    plt.xticks(np.arange(0, 21, 2))
+    plt.xticks(TICKS)
     plt.ylim(-1, 21)
-    plt.yticks(np.arange(0, 21, 2))
+    plt.yticks(TICKS)
     # plot patterns (Eq Payoff, Eq Contribs, Prop to Returns)
-    if pattern == "Lf":
-        plt.plot(x, x, '--k', label="$45^\circ$ (L matches L-leader)")
-        plt.plot(x, 2*x/5, ':k', label="Equal payoffs wrt H-leader")
-        plt.plot(x, 2*x/3, '-.k', label="Proportional to return wrt H-leader")
-    elif pattern == "Hf":
-        plt.plot(
-            x,
-            np.minimum(x*2, 20*np.ones(x.shape)),
-            ':k',
-            label="Equal payoffs wrt L-leader"
-        )
-        plt.plot(x, x, '--k', label="$45^\circ$ (H matches H-leader)")
-        plt.plot(
-            x,
-            np.minimum(x*1.5, 20*np.ones(x.shape)),
-            '-.k',
-            label="Proportional to return wrt L-leader"
-        )
-    elif pattern == "Hl":
-        plt.plot(x, x, '--k', label="$45^\circ$ (H matches H-leader)")
-        plt.plot(x, 2*x/5, ':k', label="Equal payoffs, L-follower")
-        plt.plot(x, 2*x/3, '-.k', label="Proportional to return, L-follower")
-    elif pattern == "Ll":
-        plt.plot(
-            x,
-            np.minimum(x*2, 20*np.ones(x.shape)),
-            ':k',
-            label="Equal payoffs, H-follower"
-        )
-        plt.plot(x, x, '--k', label="$45^\circ$ (L matches L-leader)")
-        plt.plot(
-            x,
-            np.minimum(x*1.5, 20*np.ones(x.shape)),
-            '-.k',
-            label="Proportional to return, H-follower"
-        )
+    if pattern in PATTERNS:
+        for y, style, label in PATTERNS[pattern]:
+            plt.plot(x, y(x), style, label=label)
     else:
         if pattern != "":
             raise ValueError("Should provide either empty (string) pattern, \
                 or 'Lf', 'Hf', 'Ll', or 'Hl'!")
     plt.legend(loc=2)
     plt.title(fig_title, fontsize="x-large")
-    # graph.tight_layout()  # an alternative to `bbox_inches' below
-    graph.savefig(ppj('OUT_FIGURES', project, fig_name), bbox_inches='tight')
+    graph.savefig(ppj('OUT_FIGURES', project, fig_name))
+    plt.close(graph)
 
 
 def label_diff(ax, text, df, row, columns, extra_space=0):
@@ -238,11 +270,22 @@ def slicing(
                 + "cannot restrict dataframe with query {}".format(restrict)
             )
             raise
+    # select the rows with *slice* values before building the index
+    try:
+        if isinstance(from_level, str):
+            selected = restricted[restricted[from_level] == slice]
+        else:
+            selected = restricted[
+                (restricted[from_level] == list(slice)).all(axis=1)
+            ]
+    except:
+        print("No such values {} in level {}".format(slice, from_level))
+        raise
     if not sort_by:
-        sorted = restricted.set_index(from_level)
+        sorted = selected.set_index(from_level)
     else:
         try:
-            sorted = restricted.set_index(from_level).sort_values(sort_by)
+            sorted = selected.set_index(from_level).sort_values(sort_by)
         except:
             print("Cannot sort by these columns: {}".format(sort_by))
             raise
@@ -293,7 +336,7 @@ def summarize(
         grouped = restricted
     else:
         try:
-            grouped = restricted.groupby(grouping)
+            grouped = restricted.groupby(grouping, observed=True)
         except:
             print("Cannot group by {}".format(grouping))
             raise
@@ -304,21 +347,11 @@ def summarize(
         print("Cannot select column {}".format(column))
         raise
 
-    if fun.lower() == "mean":
-        statistic = found.mean()
-    elif fun.lower() == "std":
-        statistic = found.std()
-    elif fun.lower() == "min":
-        statistic = found.min()
-    elif fun.lower() == "max":
-        statistic = found.max()
-    elif fun.lower() == "count":
-        statistic = found.count()
-    elif fun.lower() == "median":
-        statistic = found.median()
-    else:
+    name = STATISTICS.get(fun.lower())
+    if name is None:
         print("No such function available: {}".format(fun))
         return False
+    statistic = found.agg(name)
 
     return pandas.DataFrame(statistic)
 
@@ -378,10 +411,13 @@ def reshape(
         else:
             raise NameError
         try:
-            df[new_type] = df[new_type].map({
-                1: "Low type",
-                2: "High type"
-            })
+            df[new_type] = pandas.Categorical(
+                df[new_type].map({
+                    1: "Low type",
+                    2: "High type"
+                }),
+                categories=["High type", "Low type"]
+            )
         except:
             print("No such a column: {}".format(new_type))
             raise
@@ -394,10 +430,11 @@ def reshape(
         else:
             raise NameError
         try:
-            df[new_type] = df.where(
-                df['role'] == 2,
+            df[new_type] = np.where(
+                df['role'].to_numpy() == 2,
+                df[old_type].to_numpy(),
                 0
-            )[old_type]
+            )
         except:
             print("Either:\n")
             print("\t - no such columns: 'type' or 'role', or\n")
@@ -405,11 +442,15 @@ def reshape(
             print
             raise
         try:
-            df[new_type] = df[new_type].map({
-                0: "Leader",
-                1: "L-follower",
-                2: "H-follower"
-            })
+            df[new_type] = pandas.Categorical(
+                df[new_type].map({
+                    0: "Leader",
+                    1: "L-follower",
+                    2: "H-follower"
+                }),
+                categories=["Leader", "L-follower", "H-follower"],
+                ordered=True
+            )
             df = df.drop([old_type, 'role'], 1)
         except:
             print("No values: 0, 1, 2 in players' types")
@@ -6,12 +6,80 @@ The file requires to be called without an argument.
 """
 
 
+import os
 import pandas as pd
 import numpy as np
 import sys
 
 from bld.project_paths import project_paths_join as ppj
 
+try:
+    from numba import njit
+except ImportError:
+    # without numba the FIFO kernel below runs as plain Python
+    def njit(**kwargs):
+        return lambda f: f
+
+
+@njit(cache=True)
+def fifo(modate, owed, rep, sw, starts, ends, out_r2w):
+    """Fills *out_r2w* with the shares of wages repaid according to the
+    "first in, first out" rule (see :func:`shares`).
+
+    Arrays *modate*, *owed* (amount owed), *rep* (amount repaid) and
+    *sw* (supposed wage) must be sorted by id, wave and modate;
+    the rows of each (id, wave) group are ``starts[g]:ends[g]``.
+    Arrears are compensated month after month, so the months following
+    the first arrear must be present in the group.
+    """
+
+    for g in range(len(starts)):
+        # first modate with arrears during the wave
+        fa_idx = -1
+        for i in range(starts[g], ends[g]):
+            if not np.isnan(owed[i]):
+                fa_idx = i
+                break
+        if fa_idx < 0:
+            continue
+        fa_date = modate[fa_idx]
+        # arrear amount and wage in the respective first arrear modate
+        fa = owed[fa_idx]
+        fa_wage = sw[fa_idx]
+
+        # now, for each REPAYMENTS month
+        for i in range(starts[g], ends[g]):
+            if np.isnan(rep[i]):
+                continue
+            # how much was repaid in a given month
+            rest_rep = rep[i]
+
+            # FIFO repayments:
+            # calculate the shares repaid according to the
+            # "first in, first out" rule.
+            # If in this month repaid more than was amount of arrears
+            # in the first month
+            share_repaid = 0.0
+            while rest_rep > fa:
+                # how much of the corresponding share we should subtract
+                share_repaid = share_repaid + fa/fa_wage
+                # this is how much more was repaid
+                # (after the first arrear was compensated)
+                rest_rep = rest_rep - fa
+                # take next month
+                # (now, this is the "first" yet uncompensated month)
+                fa_idx += 1
+                fa_date += 1
+                if fa_idx >= ends[g] or modate[fa_idx] != fa_date:
+                    raise KeyError("No next month to compensate arrears")
+                # take arrear from that month
+                fa = owed[fa_idx]
+                fa_wage = sw[fa_idx]
+            share_repaid = share_repaid + rest_rep/fa_wage
+            out_r2w[i] = share_repaid
+            # yet unpaid amount from the first arrear
+            fa = fa - rest_rep
+
 
 def shares():
     """Reads DataFrame from the file :file:`to_compute_shares.dta` located in
@@ -36,101 +104,65 @@ def shares():
         * amount_repaid.
     """
 
-    df = pd.read_stata(ppj('DATA_TEMP', 'to_compute_shares.dta'))
-
     # What must be in the columns in Stata file:
     # id, wave, modate, wage, amount_owed, amount_repaid
-    df = df.set_index(['id', 'wave', 'modate'])
-    df["a2w"] = np.nan
-    df["cumsum_a2w"] = np.nan
-    df["r2w"] = np.nan
-    df["r2cw"] = np.nan
-    df["cumsum_r2w"] = np.nan
-    df["shares"] = np.nan
-    df["cumsum_shares"] = np.nan
-    df["psy_costs"] = np.nan
+    # (modate is kept as a number of month, not converted to a date)
+    df = pd.read_stata(
+        ppj('DATA_TEMP', 'to_compute_shares.dta'),
+        columns=[
+            'id', 'wave', 'modate', 'wage', 'amount_owed', 'amount_repaid'
+        ],
+        convert_categoricals=False,
+        convert_dates=False
+    )
+
+    df = df.set_index(['id', 'wave', 'modate']).sort_index()
+    owed = df["amount_owed"].to_numpy(dtype=np.float64)
+    wage = df["wage"].to_numpy(dtype=np.float64)
+    rep = df["amount_repaid"].to_numpy(dtype=np.float64)
     # calculate the wage that was supposed to be paid
-    df["supp_wage"] = (
-        df["amount_owed"].fillna(0) + df["wage"]
-    ).values
-    df["a2w"] = (
-        df["amount_owed"] / df["supp_wage"]
-    ).values
-    df["r2cw"] = (
-        df["amount_repaid"] / df["supp_wage"]
-    ).values
+    sw = np.where(np.isnan(owed), wage, owed + wage)
+    df["supp_wage"] = sw
+    with np.errstate(divide='ignore', invalid='ignore'):
+        df["a2w"] = owed / sw
+        df["r2cw"] = rep / sw
     # Sometimes STATA handles string to numeric conversions very badly
     # In case of problems, check the following line:
     # df["wage"] = np.around(df["wage"]*100).values.astype(int) / 100
 
-    # for each INDIVIDUAL in the sample
-    for id in df.reset_index()["id"].unique():
-        # for each WAVE individual was working
-        for wave in df.loc[id].index.get_level_values('wave').unique():
-            df.loc[(id, wave), "cumsum_a2w"] = \
-                df.loc[(id, wave)]["a2w"].cumsum().values
-            # modate when arrears appear during wave for the first time
-            fa_date = df.loc[(id, wave)].dropna(
-                subset=["amount_owed"]
-            ).index.get_level_values('modate').min()
-            # arrear amount in the respective first arrear modate
-            if not np.isnan(fa_date):
-                fa = df.loc[(id, wave, fa_date)]["amount_owed"]
-                # wage in the respective first arrear modate
-                fa_wage = df.loc[(id, wave, fa_date)]["supp_wage"]
-
-                # now, for each REPAYMENTS month
-                for date in df.loc[(id, wave)].dropna(
-                    subset=["amount_repaid"]
-                ).index.get_level_values('modate'):
-                    # how much was repaid in a given month
-                    rest_rep = df.loc[(id, wave, date)]["amount_repaid"]
-
-                    # FIFO repayments:
-                    # calculate the shares repaid according to the
-                    # "first in, first out" rule.
-                    # If in this month repaid more than was amount of arrears
-                    # in the first month
-                    share_repaid = 0
-                    while rest_rep > fa:
-                        # how much of the corresponding share we should subtract
-                        share_repaid = share_repaid + fa/fa_wage
-                        # this is how much more was repaid
-                        # (after the first arrear was compensated)
-                        rest_rep = rest_rep - fa
-                        # take next month
-                        # (now, this is the "first" yet uncompensated month)
-                        fa_date += 1
-                        # take arrear from that month
-                        fa = df.loc[(id, wave, fa_date)]["amount_owed"]
-                        fa_wage = df.loc[(id, wave, fa_date)]["supp_wage"]
-                    share_repaid = share_repaid + rest_rep/fa_wage
-                    df.loc[(id, wave, date), "r2w"] = share_repaid
-                    # yet unpaid amount from the first arrear
-                    fa = fa - rest_rep
-            # for each worker and wave:
-            df.loc[(id, wave), "cumsum_r2w"] = \
-                df.loc[(id, wave)]["r2w"].cumsum().values
-            df.loc[(id, wave), "shares"] = (
-                df.loc[(id, wave)]["a2w"].fillna(0) \
-                - df.loc[(id, wave)]["r2w"].fillna(0)
-            ).values
-            df.loc[(id, wave), "cumsum_shares"] = \
-                df.loc[(id, wave)]["shares"].cumsum().values
-
-        # compute accumulated ``psychological costs'' for each individual
-        # (cumulative across ALL waves)
-        df.loc[id, "costs"] = (
-            df.loc[id]["r2w"].fillna(0) - df.loc[id]["r2cw"].fillna(0)
-        ).values
-        df.loc[id, "psy_costs"] = \
-            df.loc[id]["costs"].cumsum().values
+    # FIFO repayments for each INDIVIDUAL and WAVE
+    # (rows are sorted, so the groups are consecutive blocks of rows)
+    groups = pd.factorize(df.index.droplevel('modate'))[0]
+    starts = np.flatnonzero(np.r_[True, np.diff(groups) != 0])
+    ends = np.append(starts[1:], len(groups))
+    r2w = np.full(len(df), np.nan)
+    fifo(
+        df.index.get_level_values('modate').to_numpy(dtype=np.float64),
+        owed,
+        rep,
+        sw,
+        starts,
+        ends,
+        r2w
+    )
+    df["r2w"] = r2w
+
+    # for each worker and wave:
+    df["shares"] = df["a2w"].fillna(0) - df["r2w"].fillna(0)
+    df[["cumsum_a2w", "cumsum_r2w", "cumsum_shares"]] = df[
+        ["a2w", "r2w", "shares"]
+    ].groupby(level=['id', 'wave'], sort=False).cumsum().to_numpy()
+
+    # compute accumulated ``psychological costs'' for each individual
+    # (cumulative across ALL waves)
+    df["costs"] = df["r2w"].fillna(0) - df["r2cw"].fillna(0)
+    df["psy_costs"] = df.groupby(level='id')["costs"].cumsum()
 
     # if needed in a specific file
     # fileout_dta = filein.split(".")[0].replace("-", "_") + ".dta"
     # save all variables generated in the script
     # (although, need only first four!)
-    df[[
+    out = df[[
         "cumsum_shares",
         "psy_costs",
         "cumsum_a2w",
@@ -140,7 +172,17 @@ def shares():
         "r2cw",
         "costs",
         "shares",
-    ]].astype(float).to_stata(ppj('DATA_TEMP', 'computed_shares.dta'))
+    ]].astype(float)
+    fileout_dta = ppj('DATA_TEMP', 'computed_shares.dta')
+    # set OUT_PARQUET to write a Parquet file instead of the Stata one
+    if os.environ.get('OUT_PARQUET'):
+        out.to_parquet(
+            os.path.splitext(fileout_dta)[0] + '.parquet',
+            engine='pyarrow',
+            compression='zstd'
+        )
+    else:
+        out.to_stata(fileout_dta, version=117, write_index=True)
 
 
 
@@ -10,12 +10,16 @@ Must be called with an argument --- input filename.
 
 
 # import libraries
+import os
+import re
 import pandas as pd
-import numpy as np
 import sys
 
 from bld.project_paths import project_paths_join as ppj
 
+# pattern for new ids in string variables, e.g. "1 нов" -> "10000"
+NEW_ID_PAT = re.compile(r"(?P<one>\d) нов")
+
 
 class spec_dict(dict):
     """Special class for an 'extended' dictionary that returns
@@ -41,7 +45,7 @@ def to_stata_b(filein):
         rd = pd.read_excel(
             ppj("IN_DATA", "Excel", filein),
             header=None,
-            encoding='cp1251'
+            engine='openpyxl'
         )
     except:
         raise
@@ -68,32 +72,23 @@ def to_stata_b(filein):
         "премия, фиксированный процент от оклада": 1,
     }
     # rename columns
-    new_colnames = []
-    months = rd.iloc[1].map(months_ru_en)
-    years = rd.iloc[0]
-    prev_year = ""
-    for i in np.arange(len(rd.columns)):
-        if months[i] == "id":
-            new_colnames.append("id")
-            continue
-        if (months[i] == "yearly"):
-            new_colnames.append("yearly_{}".format(prev_year))
-            continue
-        if years[i] == \
-            "доплаты за досрочное выполнение работ, за срочность работ":
-            new_colnames.append("yearly_{}".format(months[i]))
-            continue
-        year = str(years[i]).replace("год", "").strip()
-        new_colnames.append("b_{m}{y}".format(
-            m=months[i],
-            y=year
-        ))
-        prev_year = year
-    rd.columns = new_colnames
+    # map(str) keeps blank cells as "nan" (e.g. column "b_nannan")
+    months = rd.iloc[1].map(months_ru_en).map(str)
+    years = rd.iloc[0].map(str)
+    year = years.str.replace("год", "").str.strip()
+    is_id = months == "id"
+    is_yearly = months == "yearly"
+    is_extra = years == \
+        "доплаты за досрочное выполнение работ, за срочность работ"
+    # yearly bonuses take the year of the preceding monthly column
+    prev_year = year.where(~(is_id | is_yearly | is_extra)).ffill().fillna("")
+    new_colnames = ("b_" + months + year) \
+        .mask(is_extra, "yearly_" + months) \
+        .mask(is_yearly, "yearly_" + prev_year) \
+        .mask(is_id, "id")
+    rd.columns = new_colnames.tolist()
     # create new id from string variables
-    pat = r"(?P<one>\d) нов"
-    repl = lambda m: m.group('one') + '0000'
-    rd["new_id"] = rd["id"].str.replace(pat, repl)
+    rd["new_id"] = rd["id"].str.replace(NEW_ID_PAT, r"\g<one>0000", regex=True)
     rd["person_id"] = pd.to_numeric(
         rd["new_id"].combine_first(rd["id"]),
         errors='coerce',
@@ -108,8 +103,21 @@ def to_stata_b(filein):
     # rd.to_csv(ppj('DATA_TEMP', fileout_csv))
 
     # Write STATA file
+    # (or a Parquet file with the same name, if OUT_PARQUET is set)
     fileout_dta = filein.split(".")[0].replace("-", "_") + ".dta"
-    rd.astype(float).to_stata(ppj('DATA_TEMP', fileout_dta))
+    rd = rd.astype(float)
+    if os.environ.get('OUT_PARQUET'):
+        rd.to_parquet(
+            ppj('DATA_TEMP', fileout_dta.replace('.dta', '.parquet')),
+            engine='pyarrow',
+            compression='zstd'
+        )
+    else:
+        rd.to_stata(
+            ppj('DATA_TEMP', fileout_dta),
+            version=117,
+            write_index=True
+        )
 
 
 